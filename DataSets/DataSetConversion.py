@@ -1,7 +1,10 @@
 import os
-import json
+from multiprocessing import Pool
 import cv2
+import ijson
+import imagesize
 import numpy as np
+import orjson
 
 base_json_dir = '/DataSets/cityscapes/gtFine'  # Path to /cityscapes/gtFine
 base_img_dir = '/DataSets/cityscapes/leftImg8bit'  # Path to /cityscapes/leftImg8bit
@@ -9,86 +12,160 @@ base_output_dir = '/DataSets/cityscapes2'  # Path to destinaton folder (converte
 
 dirs_file_path = '/home/araba/PycharmProjects/Ozgur/Dirs.txt' # Path to List of Directories containing Original Dataset
 
-def draw_bounding_boxes_and_get_info(image, objects):
-    annotated_objects = []
+DRAW_IMAGES = True  # False: only write bounding box JSONs, image size is read from the PNG header
+DECODE_SCALE = 1  # 1, 2, 4 or 8: drawn images and their JSONs are downscaled (saves drawing/encoding, not PNG decoding); ignored when DRAW_IMAGES is False
+PNG_COMPRESSION = None  # None keeps OpenCV's default (level 1 with Z_RLE, the fastest); any 0-9 level switches zlib to its slower default strategy
+
+# The pure-Python ijson fallback is ~30x slower than json.load, so require the C backend
+try:
+    ijson_backend = ijson.get_backend('yajl2_c')
+except ImportError as e:
+    raise ImportError("ijson's yajl2_c backend is required (install ijson with its C extension)") from e
+
+IMREAD_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+def get_bounding_boxes(polygons):
+    # Reduce all polygons of an image in a single pass: vertices are stacked once
+    # and min/max are taken per polygon segment, giving an (N, 4) array of
+    # [x_min, y_min, x_max, y_max] rows.
+    points = np.concatenate(polygons)
+    offsets = np.cumsum([0] + [len(p) for p in polygons[:-1]])
+    mins = np.minimum.reduceat(points, offsets, axis=0)
+    maxs = np.maximum.reduceat(points, offsets, axis=0)
+    return np.hstack((mins, maxs))
+
+def get_annotations(objects, scale=1):
+    # Objects are consumed one at a time and only the label and an int32 copy of
+    # the polygon are kept, so each parsed object dict is freed right after use.
+    labels = []
+    polygons = []
     for obj in objects:
         if 'polygon' in obj:
-            points = np.array(obj['polygon'], dtype=np.int32)
-            cv2.polylines(image, [points], isClosed=True, color=(0, 255, 0), thickness=2)
+            labels.append(obj['label'])
+            points = np.asarray(obj['polygon'], dtype=np.int32)
+            polygons.append(points // scale if scale != 1 else points)
 
-            x_min = int(np.min(points[:, 0]))
-            x_max = int(np.max(points[:, 0]))
-            y_min = int(np.min(points[:, 1]))
-            y_max = int(np.max(points[:, 1]))
+    if not polygons:
+        return [], []
 
-            cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (255, 0, 0), 2)
+    bboxes = get_bounding_boxes(polygons).tolist()
 
-            annotated_objects.append({
-                'label': obj['label'],
-                'bbox': [x_min, y_min, x_max, y_max]
-            })
+    annotated_objects = [{
+        'label': label,
+        'bbox': bbox
+    } for label, bbox in zip(labels, bboxes)]
 
-    return image, annotated_objects
-
-# Read list of directories to process
-with open(dirs_file_path, 'r') as f:
-    directories = [line.strip() for line in f.readlines() if line.strip()]
+    return polygons, annotated_objects
 
-for cur_file_being_processed in directories:
-    print(f"\n📂 Now processing directory: {cur_file_being_processed}")
+def draw_bounding_boxes_and_get_info(image, objects, scale=1):
+    polygons, annotated_objects = get_annotations(objects, scale)
 
-    json_dir = os.path.join(base_json_dir, cur_file_being_processed)
-    img_dir = os.path.join(base_img_dir, cur_file_being_processed)
-    output_dir = os.path.join(base_output_dir, cur_file_being_processed)
+    # Drawn object by object so each box is painted before the next polygon outline
+    for points, annotated_object in zip(polygons, annotated_objects):
+        cv2.polylines(image, [points], isClosed=True, color=(0, 255, 0), thickness=2)
 
-    os.makedirs(output_dir, exist_ok=True)
+        x_min, y_min, x_max, y_max = annotated_object['bbox']
+        cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (255, 0, 0), 2)
 
-    if not os.path.exists(json_dir):
-        print(f"❌ Directory not found: {json_dir}")
-        continue
+    return image, annotated_objects
 
-    json_files = sorted([f for f in os.listdir(json_dir) if f.endswith('.json')])
+def init_worker():
+    # Each worker handles a single image, so OpenCV's own thread pool would only
+    # oversubscribe the CPUs shared with the other workers.
+    cv2.setNumThreads(1)
 
-    for json_file in json_files:
-        json_path = os.path.join(json_dir, json_file)
-        image_name = json_file.replace('_gtFine_polygons.json', '_leftImg8bit.png')
-        image_path = os.path.join(img_dir, image_name)
+def process_one(args):
+    json_file, json_dir, img_dir, output_dir = args
 
-        print(f"\n🔄 Processing image: {image_name}")
+    json_path = os.path.join(json_dir, json_file)
+    image_name = json_file.replace('_gtFine_polygons.json', '_leftImg8bit.png')
+    image_path = os.path.join(img_dir, image_name)
 
-        if not os.path.exists(image_path):
-            print(f"❌ Image file not found: {image_path}")
-            continue
+    print(f"\n🔄 Processing image: {image_name}")
 
-        with open(json_path, 'r') as f:
-            data = json.load(f)
+    if not os.path.exists(image_path):
+        print(f"❌ Image file not found: {image_path}")
+        return
 
-        image = cv2.imread(image_path)
+    if DRAW_IMAGES:
+        image = cv2.imread(image_path, IMREAD_FLAGS[DECODE_SCALE])
         if image is None:
             print(f"❌ Failed to load image: {image_path}")
-            continue
+            return
 
-        processed_image, annotated_objects = draw_bounding_boxes_and_get_info(image, data.get('objects', []))
+        # Objects are streamed from the polygon file, only their labels and polygons are kept
+        with open(json_path, 'rb') as f:
+            objects = ijson_backend.items(f, 'objects.item', use_float=True)
+            processed_image, annotated_objects = draw_bounding_boxes_and_get_info(image, objects, DECODE_SCALE)
 
         print("✅ Image processed.")
 
         output_img_path = os.path.join(output_dir, image_name)
-        os.makedirs(os.path.dirname(output_img_path), exist_ok=True)
-        cv2.imwrite(output_img_path, processed_image)
+        if PNG_COMPRESSION is None:
+            cv2.imwrite(output_img_path, processed_image)
+        else:
+            cv2.imwrite(output_img_path, processed_image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
 
         print(f"💾 Image saved as: {output_img_path}")
 
-        # Create new JSON file with bounding box annotations
-        output_json = {
-            "imgHeight": image.shape[0],
-            "imgWidth": image.shape[1],
-            "objects": annotated_objects
-        }
+        img_height, img_width = image.shape[:2]
+    else:
+        # Only the size is needed, which imagesize reads without decoding the PNG
+        img_width, img_height = imagesize.get(image_path)
+        if img_width < 0:
+            print(f"❌ Failed to read image size: {image_path}")
+            return
+
+        with open(json_path, 'rb') as f:
+            objects = ijson_backend.items(f, 'objects.item', use_float=True)
+            _, annotated_objects = get_annotations(objects)
+
+    # Create new JSON file with bounding box annotations
+    output_json = {
+        "imgHeight": img_height,
+        "imgWidth": img_width,
+        "objects": annotated_objects
+    }
+
+    output_json_name = image_name.replace('_leftImg8bit.png', '_boundingboxes.json')
+    output_json_path = os.path.join(output_dir, output_json_name)
+
+    with open(output_json_path, 'wb') as f:
+        f.write(orjson.dumps(output_json, option=orjson.OPT_INDENT_2))
+
+    print(f"📝 JSON saved as: {output_json_path}")
+
+if __name__ == '__main__':
+    if DECODE_SCALE not in IMREAD_FLAGS:
+        raise ValueError(f"DECODE_SCALE must be one of {sorted(IMREAD_FLAGS)}, got {DECODE_SCALE}")
+
+    # Read list of directories to process
+    with open(dirs_file_path, 'r') as f:
+        directories = [line.strip() for line in f.readlines() if line.strip()]
+
+    with Pool(processes=os.cpu_count(), initializer=init_worker) as pool:
+        for cur_file_being_processed in directories:
+            print(f"\n📂 Now processing directory: {cur_file_being_processed}")
+
+            json_dir = os.path.join(base_json_dir, cur_file_being_processed)
+            img_dir = os.path.join(base_img_dir, cur_file_being_processed)
+            output_dir = os.path.join(base_output_dir, cur_file_being_processed)
+
+            os.makedirs(output_dir, exist_ok=True)
 
-        output_json_name = image_name.replace('_leftImg8bit.png', '_boundingboxes.json')
-        output_json_path = os.path.join(output_dir, output_json_name)
+            if not os.path.exists(json_dir):
+                print(f"❌ Directory not found: {json_dir}")
+                continue
 
-        with open(output_json_path, 'w') as f:
-            json.dump(output_json, f, indent=4)
+            with os.scandir(json_dir) as it:
+                json_files = sorted(e.name for e in it if e.is_file() and e.name.endswith('.json'))
 
-        print(f"📝 JSON saved as: {output_json_path}")
+            # Images are independent of each other, so they are converted in parallel
+            tasks = [(json_file, json_dir, img_dir, output_dir) for json_file in json_files]
+            for _ in pool.imap_unordered(process_one, tasks, chunksize=8):
+                pass